@@ -3,9 +3,11 @@ import os
 import time
 import pandas as pd
 from dotenv import load_dotenv
-from src.utils import convert_pdf_to_images, init_db, save_to_db, get_all_history, delete_history, check_cache
+from src.utils import convert_pdf_to_images, extract_pdf_text, extract_pdf_word_boxes, init_db, save_to_db, get_all_history, delete_history, check_cache, get_history_record
 from src.agent import run_ir_agent
-from src.drive_api import get_drive_files, download_drive_file, create_result_folder, upload_to_drive
+from src.drive_api import get_drive_service, get_drive_files, download_drive_file, create_result_folder, refresh_result_folder, report_filename
+from src.drive_upload import UploadPipeline
+from src.dedup import compute_fingerprint, fingerprint_from_pages, diff_pages, get_index, register_fingerprint
 
 # 환경변수 로드
 load_dotenv()
@@ -24,25 +26,93 @@ with tab1:
     uploaded_file = st.file_uploader("PDF 파일을 선택하세요", type="pdf", key="manual_upload")
     
     if uploaded_file:
-        if st.button("🚀 즉시 분석", key="run_manual"):
+        pdf_content = uploaded_file.getvalue()
+        
+        # 중복 IR 탐지: 파일명이 달라도 내용이 거의 같은 기존 분석이 있으면 재사용/비교를 제안
+        # 이 파일명으로 이미 저장된 결과(재사용 복사본 포함)가 있으면 자기 자신과 비교하게 되므로 생략
+        dup_record, dup_score, dup_fp = None, 0, None
+        if not check_cache(uploaded_file.name):
+            fp_key = f"fp_{uploaded_file.name}_{uploaded_file.size}"
+            if fp_key not in st.session_state:
+                with st.spinner("기존 분석 자료와 비교 중..."):
+                    fingerprint = compute_fingerprint(pdf_content)
+                    # 조회 결과도 함께 캐시하여 버튼 클릭 등 재실행마다 인덱스를 다시 조회하지 않음
+                    st.session_state[fp_key] = (fingerprint, get_index().query(fingerprint))
+            fingerprint, duplicates = st.session_state[fp_key]
+            
+            # 이후 삭제된 기록(이 세션 또는 다른 프로세스)은 후보에서 제외
+            if duplicates:
+                dedup_index = get_index()
+                for candidate_id, candidate_score in duplicates:
+                    candidate_record = get_history_record(candidate_id)
+                    candidate_fp = dedup_index.get(candidate_id)
+                    if candidate_record and candidate_fp:
+                        dup_record, dup_score, dup_fp = candidate_record, candidate_score, candidate_fp
+                        break
+        
+        if dup_record:
+            page_map = diff_pages(fingerprint, dup_fp)
+            text_changed = [i + 1 for i, (_, status, _) in enumerate(page_map) if status == "text_changed"]
+            new_pages = [i + 1 for i, (_, status, _) in enumerate(page_map) if status == "new"]
+            st.warning(
+                f"⚠️ 기존 분석 자료 '{dup_record['filename']}' ({dup_record['analysis_date']})와 "
+                f"{dup_score:.0%} 유사합니다. 기존 결과를 재사용하면 분석 시간을 절약할 수 있습니다."
+            )
+            reuse_col, note_col = st.columns([1, 3])
+            if reuse_col.button("♻️ 기존 결과 재사용", key="reuse_dup"):
+                # 새 파일명으로도 캐시가 적중하도록 기존 결과를 복사해 저장
+                record_id = save_to_db(uploaded_file.name, dup_record['page_detail'], dup_record['strategic_summary'])
+                register_fingerprint(record_id, fingerprint)
+                st.session_state.current_view = {
+                    "filename": uploaded_file.name,
+                    "page_detail": dup_record['page_detail'],
+                    "strategic_summary": dup_record['strategic_summary']
+                }
+                st.rerun()
+            if text_changed:
+                # 레이아웃은 같지만 수치 등 텍스트가 바뀐 페이지: 재사용 시 기존 리포트의 수치가 최신이 아님
+                note_col.error(
+                    f"텍스트 변경 {len(text_changed)}페이지 ({', '.join(map(str, text_changed))}) — "
+                    "재사용하면 해당 페이지의 수치가 최신 자료와 다를 수 있습니다."
+                )
+            if new_pages:
+                note_col.info(f"신규 페이지 {len(new_pages)}개")
+            with st.expander("🔀 페이지 비교"):
+                same_count = len(page_map) - len(text_changed) - len(new_pages)
+                st.write(
+                    f"총 {len(page_map)}페이지 중 동일 {same_count}페이지 / "
+                    f"텍스트 변경 {len(text_changed)}페이지 / 신규 {len(new_pages)}페이지"
+                )
+                for i, (old_page, status, text_sim) in enumerate(page_map):
+                    if status == "same":
+                        st.write(f"- {i + 1}페이지: 기존 {old_page}페이지와 동일")
+                    elif status == "text_changed":
+                        overlap = f" (텍스트 일치율 약 {text_sim:.0%})" if text_sim is not None else ""
+                        st.write(f"- {i + 1}페이지: ✏️ 기존 {old_page}페이지와 레이아웃은 같지만 텍스트(수치)가 변경됨{overlap}")
+                    else:
+                        st.write(f"- {i + 1}페이지: 🆕 신규 또는 변경된 페이지")
+        
+        if st.button("🚀 새로 분석" if dup_record else "🚀 즉시 분석", key="run_manual"):
             # 타이머 및 상태 표시용 컨테이너
             status_container = st.empty()
             start_time = time.time()
             
             with st.status("분석 진행 중...") as s:
                 # 1단계: 파일 로드
-                pdf_content = uploaded_file.read()
                 elapsed = int(time.time() - start_time)
                 status_container.info(f"⏱️ 경과 시간: {elapsed}초 | PDF 파일을 읽고 있습니다...")
                 
                 # 2단계: 이미지 변환 (최적화된 utils 활용)
                 images = convert_pdf_to_images(pdf_content)
+                page_texts = extract_pdf_text(pdf_content)
+                page_boxes = extract_pdf_word_boxes(pdf_content)
                 elapsed = int(time.time() - start_time)
                 status_container.info(f"⏱️ 경과 시간: {elapsed}초 | 이미지 변환 완료! Gemini AI 분석을 시작합니다...")
                 
                 # 3단계: AI 분석
-                page_md, total_md = run_ir_agent(API_KEY, images)
-                save_to_db(uploaded_file.name, page_md, total_md)
+                page_md, total_md = run_ir_agent(API_KEY, images, page_texts, page_boxes=page_boxes)
+                record_id = save_to_db(uploaded_file.name, page_md, total_md)
+                register_fingerprint(record_id, fingerprint_from_pages(images, page_texts))
                 
                 # 완료 리포트
                 end_time = time.time()
@@ -79,6 +149,7 @@ with tab1:
                     }
                 if c4.button("🗑️", key=f"del_{row['id']}"):
                     delete_history(row['id'])
+                    get_index().remove(row['id'])
                     st.rerun()
         else:
             st.info("검색 결과가 없습니다.")
@@ -96,44 +167,66 @@ with tab2:
             st.success(f"✅ 연결 성공! (총 {len(files)}개 파일 / 미분석 {len(unprocessed_files)}개)")
             
             if unprocessed_files:
+                bundle_mode = st.checkbox("📦 결과 보고서를 zip 하나로 묶어 업로드", key="bundle_upload")
                 if st.button(f"🔥 미분석 {len(unprocessed_files)}건 일괄 분석 시작"):
                     res_folder_id = create_result_folder(folder_id)
                     
+                    # 업로드는 별도 워커가 처리하므로 다음 파일 분석이 업로드를 기다리지 않습니다.
+                    uploader = UploadPipeline(get_drive_service, bundle=bundle_mode, folder_resolver=refresh_result_folder)
+                    retried = uploader.retry_outbox()
+                    if retried:
+                        st.info(f"📤 이전에 실패한 업로드 {retried}건을 다시 업로드합니다.")
+                    
                     overall_start_time = time.time()
                     progress_bar = st.progress(0)
                     status_text = st.empty()
                     timer_text = st.empty() # 전체 타이머 표시용
                     
-                    for idx, f in enumerate(unprocessed_files):
-                        file_start_time = time.time()
-                        percent = (idx + 1) / len(unprocessed_files)
-                        progress_bar.progress(percent)
-                        
-                        status_text.info(f"🔄 ({idx+1}/{len(unprocessed_files)}) '{f['name']}' 분석 중...")
-                        
-                        try:
-                            # 1단계: 다운로드
-                            pdf_bytes = download_drive_file(f['id'])
+                    # 중단(Streamlit 재실행/정지)되어도 finally에서 close()하여 예약된 결과 업로드를 마무리합니다.
+                    try:
+                        for idx, f in enumerate(unprocessed_files):
+                            file_start_time = time.time()
+                            percent = (idx + 1) / len(unprocessed_files)
+                            progress_bar.progress(percent)
                             
-                            # 2단계: 이미지 변환
-                            images = convert_pdf_to_images(pdf_bytes)
+                            status_text.info(f"🔄 ({idx+1}/{len(unprocessed_files)}) '{f['name']}' 분석 중...")
                             
-                            # 3단계: AI 분석
-                            p_md, t_md = run_ir_agent(API_KEY, images)
-                            save_to_db(f['name'], p_md, t_md)
+                            try:
+                                # 1단계: 다운로드
+                                pdf_bytes = download_drive_file(f['id'])
+                                
+                                # 2단계: 이미지 변환
+                                images = convert_pdf_to_images(pdf_bytes)
+                                page_texts = extract_pdf_text(pdf_bytes)
+                                page_boxes = extract_pdf_word_boxes(pdf_bytes)
+                                
+                                # 3단계: AI 분석
+                                p_md, t_md = run_ir_agent(API_KEY, images, page_texts, page_boxes=page_boxes)
+                                record_id = save_to_db(f['name'], p_md, t_md)
+                                register_fingerprint(record_id, fingerprint_from_pages(images, page_texts))
+                                
+                                # 4단계: 결과 업로드 예약 (비동기)
+                                full_report = f"# {f['name']} 분석 보고서\n\n{t_md}\n\n{p_md}"
+                                uploader.submit(res_folder_id, report_filename(f['name']), full_report, parent_id=folder_id)
+                                
+                                # 개별 파일 시간 및 누적 시간 표시
+                                file_dur = int(time.time() - file_start_time)
+                                total_dur = int(time.time() - overall_start_time)
+                                timer_text.markdown(f"**⏱️ 최근 파일 소요:** {file_dur}초 | **누적 경과 시간:** {total_dur}초")
                             
-                            # 4단계: 결과 업로드
-                            full_report = f"# {f['name']} 분석 보고서\n\n{t_md}\n\n{p_md}"
-                            upload_to_drive(res_folder_id, f['name'], full_report)
-                            
-                            # 개별 파일 시간 및 누적 시간 표시
-                            file_dur = int(time.time() - file_start_time)
-                            total_dur = int(time.time() - overall_start_time)
-                            timer_text.markdown(f"**⏱️ 최근 파일 소요:** {file_dur}초 | **누적 경과 시간:** {total_dur}초")
-                            
-                        except Exception as e:
-                            st.error(f"파일 {f['name']} 처리 중 오류 발생: {e}")
+                            except Exception as e:
+                                st.error(f"파일 {f['name']} 처리 중 오류 발생: {e}")
                         
+                        status_text.info("📤 남은 결과 업로드를 마무리하는 중...")
+                    finally:
+                        failed_uploads = uploader.close()
+                    
+                    for name, err, will_retry in failed_uploads:
+                        if will_retry:
+                            st.warning(f"'{name}' 업로드 실패: {err} (로컬 outbox에 보관되어 다음 실행 시 재업로드됩니다)")
+                        else:
+                            st.error(f"'{name}' 업로드 실패: {err} (재시도를 중단하고 outbox/failed 폴더에 보관했습니다)")
+                    
                     status_text.success(f"🎉 모든 파일 분석 완료! (총 소요 시간: {int(time.time() - overall_start_time)}초)")
                     time.sleep(2)
                     st.rerun()
@@ -4,10 +4,11 @@ import time
 import json
 from datetime import datetime
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+from googleapiclient.http import MediaIoBaseDownload
 from google.oauth2 import service_account
 from src.agent import run_ir_agent  # 기존에 만든 분석 로직 재사용
-from src.utils import convert_pdf_to_images
+from src.utils import convert_pdf_to_images, extract_pdf_text, extract_pdf_word_boxes
+from src.drive_upload import UploadPipeline
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -35,17 +36,26 @@ def download_file(service, file_id):
         status, done = downloader.next_chunk()
     return fh.getvalue()
 
-def upload_markdown(service, filename, content, parent_id):
-    file_metadata = {
-        'name': f"[분석완료] {filename.replace('.pdf', '')}.md",
-        'parents': [parent_id]
-    }
-    media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), 
-                              mimetype='text/markdown')
-    service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+def markdown_filename(filename):
+    return f"[분석완료] {filename.replace('.pdf', '')}.md"
 
 def process_files():
     service = get_drive_service()
+    # 결과 업로드는 백그라운드 워커가 처리 (실패 건은 로컬 outbox에 남아 다음 주기에 재업로드)
+    uploader = UploadPipeline(get_drive_service)
+    retried = uploader.retry_outbox()
+    if retried:
+        print(f"📤 이전에 실패한 업로드 {retried}건을 다시 업로드합니다.")
+    try:
+        _process_items(service, uploader)
+    finally:
+        for name, err, will_retry in uploader.close():
+            if will_retry:
+                print(f"⚠️ {name} 업로드 실패 (outbox 보관, 다음 주기에 재시도): {err}")
+            else:
+                print(f"❌ {name} 업로드 실패 (재시도 중단, outbox/failed 보관): {err}")
+
+def _process_items(service, uploader):
     
     # 1. 감시 폴더에서 PDF 파일만 조회 (이미 분석된 파일 중복 방지를 위해 이름 필터링 활용 가능)
     query = f"'{WATCH_FOLDER_ID}' in parents and mimeType='application/pdf' and trashed=false"
@@ -76,17 +86,20 @@ def process_files():
             
             # 이미지 변환
             images = convert_pdf_to_images(pdf_bytes)
+            # 텍스트 레이어 추출 (하이브리드 모드: 텍스트 위주 페이지는 텍스트로 전송)
+            page_texts = extract_pdf_text(pdf_bytes)
+            page_boxes = extract_pdf_word_boxes(pdf_bytes)
             
             # Gemini 3 고밀도 분석 엔진 실행 (기존 src.agent 활용)
-            page_md, total_md = run_ir_agent(API_KEY, images)
+            page_md, total_md = run_ir_agent(API_KEY, images, page_texts, page_boxes=page_boxes)
             
             # 최종 마크다운 구성
             full_markdown = f"# IR 분석 리포트: {file_name}\n\n"
             full_markdown += f"## 🎯 전략 통합 보고서\n\n{total_md}\n\n"
             full_markdown += f"## 📄 페이지별 상세 데이터\n\n{page_md}"
             
-            # 구글 드라이브에 업로드
-            upload_markdown(service, file_name, full_markdown, WATCH_FOLDER_ID)
+            # 구글 드라이브 업로드 예약 (다음 파일 분석이 업로드를 기다리지 않음)
+            uploader.submit(WATCH_FOLDER_ID, markdown_filename(file_name), full_markdown)
             
             # 분석 완료 후 원본 파일 이름 변경 혹은 삭제 (여기서는 이름 변경)
             service.files().update(fileId=file_id, body={'name': f"[완료] {file_name}"}).execute()
@@ -0,0 +1,266 @@
+"""
+로컬 디렉터리/글롭 대상 IR 일괄 분석 CLI (Streamlit/구글 드라이브 의존성 없음)
+
+사용 예:
+    python batch_cli.py ./decks "archive/**/*.pdf" -o reports --doc-workers 4 --page-workers 8
+
+- 문서 단위 병렬(--doc-workers)과 문서 내 페이지 단위 병렬(--page-workers)을 따로 조절합니다.
+  실제 동시 Gemini 요청 수는 최대 doc-workers x page-workers 입니다.
+- 결과는 출력 폴더에 마크다운 리포트와 manifest.jsonl(한 줄에 문서 하나)로 저장됩니다.
+- 파일 내용 해시(sha256)가 manifest에 성공으로 기록된 문서는 건너뜁니다. (--force로 재분석)
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from dotenv import load_dotenv
+from src.agent import run_ir_agent
+from src.utils import convert_pdf_to_images, extract_pdf_text, extract_pdf_word_boxes, init_db, save_to_db
+from src.dedup import fingerprint_from_pages, register_fingerprint
+
+load_dotenv()
+
+API_KEY = os.getenv("GEMINI_API_KEY")
+MANIFEST_NAME = "manifest.jsonl"
+
+def collect_pdfs(targets):
+    """디렉터리(하위 폴더 포함) 또는 글롭 패턴에서 PDF 경로 목록을 중복 없이 수집"""
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            matches = glob.glob(os.path.join(target, "**", "*.pdf"), recursive=True)
+            matches += glob.glob(os.path.join(target, "**", "*.PDF"), recursive=True)
+        else:
+            matches = glob.glob(target, recursive=True)
+        paths.extend(m for m in matches if os.path.isfile(m) and m.lower().endswith(".pdf"))
+
+    seen = set()
+    unique = []
+    for p in sorted(paths):
+        key = os.path.abspath(p)
+        if key not in seen:
+            seen.add(key)
+            unique.append(p)
+    return unique
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_done_hashes(manifest_path):
+    """manifest.jsonl에서 분석 성공한 문서의 해시 집합을 읽어옵니다."""
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 중단 시 마지막 줄이 잘려 있을 수 있음
+                continue
+            if entry.get("status") == "ok" and entry.get("sha256"):
+                done.add(entry["sha256"])
+    return done
+
+def report_path_for(out_dir, path, sha):
+    # 다른 폴더의 동일 파일명이 덮어쓰이지 않도록 해시 앞 8자리를 붙입니다.
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(out_dir, f"{stem}_{sha[:8]}_분석보고서.md")
+
+class Progress:
+    """완료 건수/처리량/ETA를 한 줄로 갱신 출력 (stderr)"""
+
+    def __init__(self, total):
+        self.total = total
+        self.ok = 0
+        self.failed = 0
+        self.pages = 0
+        self.start = time.time()
+
+    def update(self, ok, pages=0):
+        if ok:
+            self.ok += 1
+            self.pages += pages
+        else:
+            self.failed += 1
+        self.render()
+
+    def render(self):
+        done = self.ok + self.failed
+        elapsed = max(time.time() - self.start, 1e-6)
+        docs_per_min = done / elapsed * 60
+        pages_per_min = self.pages / elapsed * 60
+        if done:
+            eta = int((self.total - done) * elapsed / done)
+            eta_text = f"{eta // 3600:d}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+        else:
+            eta_text = "--:--:--"
+        line = (
+            f"\r[{done}/{self.total}] 성공 {self.ok} | 실패 {self.failed} | "
+            f"{docs_per_min:.1f} 문서/분 | {pages_per_min:.0f} 페이지/분 | "
+            f"경과 {int(elapsed)}초 | ETA {eta_text}"
+        )
+        sys.stderr.write(line)
+        sys.stderr.flush()
+
+def analyze_one(path, sha, out_dir, page_workers, hybrid, save_db):
+    """문서 하나를 분석해 리포트를 저장하고 manifest 항목(dict)을 반환"""
+    start = time.time()
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+
+    images = convert_pdf_to_images(pdf_bytes)
+    page_texts = extract_pdf_text(pdf_bytes) if hybrid else None
+    page_boxes = extract_pdf_word_boxes(pdf_bytes) if hybrid else None
+    page_md, total_md = run_ir_agent(API_KEY, images, page_texts, max_workers=page_workers, page_boxes=page_boxes)
+
+    filename = os.path.basename(path)
+    full_report = f"# {filename} 분석 보고서\n\n{total_md}\n\n{page_md}"
+    report_path = report_path_for(out_dir, path, sha)
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(full_report)
+
+    if save_db:
+        record_id = save_to_db(filename, page_md, total_md)
+        register_fingerprint(record_id, fingerprint_from_pages(images, page_texts))
+
+    return {
+        "source": os.path.abspath(path),
+        "sha256": sha,
+        "status": "ok",
+        "pages": len(images),
+        "report": os.path.abspath(report_path),
+        "seconds": round(time.time() - start, 1),
+        "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def positive_int(value):
+    """argparse용: 1 이상의 정수만 허용"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"정수가 아닙니다: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"1 이상이어야 합니다: {value}")
+    return number
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="로컬 PDF IR 자료 일괄 분석 (headless)")
+    parser.add_argument("targets", nargs="+", help="PDF가 있는 디렉터리 또는 글롭 패턴")
+    parser.add_argument("-o", "--out", default="reports", help="리포트/manifest 출력 폴더 (기본: reports)")
+    parser.add_argument("--doc-workers", type=positive_int, default=4, help="동시에 분석할 문서 수 (기본: 4)")
+    parser.add_argument("--page-workers", type=positive_int, default=15, help="문서당 동시 페이지 요청 수 (기본: 15)")
+    parser.add_argument("--no-hybrid", action="store_true", help="텍스트 레이어를 사용하지 않고 이미지로만 분석")
+    parser.add_argument("--save-db", action="store_true", help="결과를 Streamlit 히스토리 DB에도 저장")
+    parser.add_argument("--force", action="store_true", help="이미 분석된 파일도 다시 분석")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not API_KEY:
+        print("❌ GEMINI_API_KEY 환경변수가 설정되지 않았습니다.", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, MANIFEST_NAME)
+    if args.save_db:
+        init_db()
+
+    pdfs = collect_pdfs(args.targets)
+    done_hashes = set() if args.force else load_done_hashes(manifest_path)
+
+    # 해시 계산 후 이미 분석된 문서 / 이번 실행 내 중복 문서 제외
+    jobs = []
+    skipped = 0
+    for path in pdfs:
+        sha = file_sha256(path)
+        if sha in done_hashes:
+            skipped += 1
+            continue
+        done_hashes.add(sha)
+        jobs.append((path, sha))
+
+    print(f"📂 PDF {len(pdfs)}개 발견 / 건너뜀 {skipped}개 / 분석 대상 {len(jobs)}개", file=sys.stderr)
+    if not jobs:
+        return 0
+
+    progress = Progress(len(jobs))
+    failed = 0
+    interrupted = False
+    pending_jobs = iter(jobs)
+    futures = {}
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ThreadPoolExecutor(max_workers=args.doc_workers) as executor:
+
+        def submit_next():
+            for path, sha in pending_jobs:
+                future = executor.submit(analyze_one, path, sha, args.out, args.page_workers, not args.no_hybrid, args.save_db)
+                futures[future] = (path, sha)
+                return
+
+        # 전체를 한 번에 큐에 넣지 않고 doc-workers x 2 만큼만 유지합니다. (중단 시 남은 작업이 바로 멈춤)
+        for _ in range(args.doc_workers * 2):
+            submit_next()
+
+        while futures:
+            try:
+                # 1초마다 깨어나 완료 건이 없어도 경과 시간/ETA 줄을 갱신합니다.
+                finished, _ = wait(futures, timeout=1, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                if interrupted:
+                    # 두 번째 Ctrl-C: 진행 중인 문서도 기다리지 않고 즉시 종료 (manifest는 이미 줄 단위로 기록됨)
+                    sys.stderr.write("\n⛔ 강제 종료합니다. 진행 중이던 문서는 다음 실행에서 다시 분석됩니다.\n")
+                    sys.stderr.flush()
+                    manifest.flush()
+                    os._exit(130)
+                interrupted = True
+                # 아직 시작하지 않은 작업은 취소하고, 진행 중인 문서는 끝까지 기다려 manifest에 기록합니다.
+                for future in list(futures):
+                    if future.cancel():
+                        del futures[future]
+                sys.stderr.write(f"\n⏹️ 중단 요청: 진행 중인 {len(futures)}개 문서만 마무리하고 종료합니다. (한 번 더 누르면 즉시 종료)\n")
+                continue
+            if not finished:
+                progress.render()
+                continue
+            for future in finished:
+                path, sha = futures.pop(future)
+                try:
+                    entry = future.result()
+                    progress.update(True, entry["pages"])
+                except Exception as e:
+                    failed += 1
+                    entry = {
+                        "source": os.path.abspath(path),
+                        "sha256": sha,
+                        "status": "error",
+                        "error": str(e),
+                        "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    }
+                    progress.update(False)
+                # 한 줄씩 즉시 기록하여 중단되어도 완료분은 다음 실행에서 건너뜁니다.
+                manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                manifest.flush()
+                if not interrupted:
+                    submit_next()
+
+    sys.stderr.write("\n")
+    succeeded = progress.ok
+    if interrupted:
+        print(f"⏹️ 중단됨: 성공 {succeeded}개 / 실패 {failed}개 / 미처리 {len(jobs) - succeeded - failed}개 → {manifest_path}", file=sys.stderr)
+        return 130
+    print(f"✅ 완료: 성공 {succeeded}개 / 실패 {failed}개 → {manifest_path}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,7 @@ from google.genai import types
 import io
 from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+from .utils import classify_page
 
 # Gemini 3 Flash 모델 적용
 MODEL_NAME = "gemini-2.5-pro" 
@@ -46,6 +47,18 @@ PROMPT_PAGE = """
 - **명시적 추론(있는 경우에만):** (위 [추론] 형식 준수, 1~2개 이내)
 """
 
+# [하이브리드 모드] 텍스트 레이어를 함께 전송할 때 PROMPT_PAGE 뒤에 덧붙이는 안내문
+PROMPT_TEXT_LAYER = """
+[입력 형태 안내]
+- 아래 "[페이지 텍스트 레이어]"는 PDF 원본에서 직접 추출한 텍스트로, 수치와 고유명사 표기가 정확합니다.
+- 수치/고유명사는 텍스트 레이어의 표기를 우선 사용하십시오.
+- 이미지가 함께 제공된 경우, 레이아웃·도표 구조·그래프 형태는 이미지에서 확인하십시오.
+- 이미지가 제공되지 않은 경우, 텍스트 레이어에 없는 시각 요소를 추정하여 서술하지 마십시오.
+
+[페이지 텍스트 레이어]
+{page_text}
+"""
+
 # ✅ PROMPT_TOTAL은 이미 헌법급 프롬프트를 "그대로" 삽입한 버전 유지
 PROMPT_TOTAL = r"""
 당신은 **벤처캐피탈 내부 심사역을 보조하는 AI 에이전트**다.  
@@ -199,35 +212,66 @@ IR에 포함되지 않은 핵심 정보는 **사실 전달만 수행**한다.
 이제 아래 "[페이지별 고밀도 원천 데이터]"를 근거로, 위의 고정 구조에 맞는 **최종 설명문 마크다운**을 작성하라.
 """
 
-def run_ir_agent(api_key, images):
+# 페이지 분류별 이미지 전송 설정 (가로 px, JPEG 품질)
+IMAGE_SETTINGS = {
+    "image": (1600, 85),
+    # 텍스트가 함께 전송되므로 레이아웃 파악에 충분한 저해상도로 용량을 줄입니다.
+    "hybrid": (800, 70),
+}
+
+def _encode_image(img, base_width, quality):
+    # [속도 개선 핵심 1] 이미지 물리적 리사이징 (전송 용량 최적화)
+    # 가로 1600px은 Gemini 3가 표를 읽기에 매우 넉넉하면서 용량은 가벼운 크기입니다.
+    w_percent = (base_width / float(img.size[0]))
+    h_size = int((float(img.size[1]) * float(w_percent)))
+    img = img.resize((base_width, h_size), Image.Resampling.LANCZOS)
+    
+    img_byte = io.BytesIO()
+    # 품질 85(하이브리드는 70)로 압축하여 업로드 속도 극대화
+    img.save(img_byte, format='JPEG', quality=quality, optimize=True)
+    return img_byte.getvalue()
+
+def run_ir_agent(api_key, images, page_texts=None, max_workers=15, page_boxes=None):
+    """
+    페이지별 분석 후 통합 리포트를 생성합니다.
+    page_texts(utils.extract_pdf_text 결과)가 주어지면 하이브리드 모드로 동작하여
+    텍스트 위주 페이지는 텍스트(또는 텍스트 + 저해상도 이미지)로 전송하고,
+    차트/도표 위주 페이지만 기존처럼 고해상도 이미지로 전송합니다.
+    page_boxes(utils.extract_pdf_word_boxes 결과)가 있어야 텍스트만 전송하는 페이지가 생기며,
+    없으면 텍스트가 많은 페이지도 저해상도 이미지를 함께 보냅니다.
+    max_workers는 문서 하나 안에서 동시에 전송할 페이지 수입니다.
+    """
     client = genai.Client(api_key=api_key)
+    # 텍스트 레이어 페이지 수가 이미지와 다르면 매칭을 신뢰할 수 없으므로 이미지 전용으로 처리
+    if not page_texts or len(page_texts) != len(images):
+        page_texts = None
+    if not page_texts or not page_boxes or len(page_boxes) != len(images):
+        page_boxes = None
     
     def analyze_single_page(args):
         i, img = args
+        page_text = page_texts[i] if page_texts else ""
+        page_box = page_boxes[i] if page_boxes else None
+        mode = classify_page(img, page_text, page_box) if page_texts else "image"
         
-        # [속도 개선 핵심 1] 이미지 물리적 리사이징 (전송 용량 최적화)
-        # 가로 1600px은 Gemini 3가 표를 읽기에 매우 넉넉하면서 용량은 가벼운 크기입니다.
-        base_width = 1600
-        w_percent = (base_width / float(img.size[0]))
-        h_size = int((float(img.size[1]) * float(w_percent)))
-        img = img.resize((base_width, h_size), Image.Resampling.LANCZOS)
-        
-        img_byte = io.BytesIO()
-        # 품질 85로 압축하여 업로드 속도 극대화
-        img.save(img_byte, format='JPEG', quality=85, optimize=True)
+        contents = [PROMPT_PAGE.format(page_num=i+1)]
+        if mode != "image":
+            contents.append(PROMPT_TEXT_LAYER.format(page_text=page_text))
+        if mode in IMAGE_SETTINGS:
+            base_width, quality = IMAGE_SETTINGS[mode]
+            contents.append(
+                types.Part.from_bytes(data=_encode_image(img, base_width, quality), mime_type='image/jpeg')
+            )
         
         response = client.models.generate_content(
             model=MODEL_NAME,
-            contents=[
-                PROMPT_PAGE.format(page_num=i+1),
-                types.Part.from_bytes(data=img_byte.getvalue(), mime_type='image/jpeg')
-            ]
+            contents=contents
         )
         return i, response.text
 
     # [속도 개선 핵심 2] 유료 사용자를 위한 고성능 병렬 스레드 (max_workers=15)
     # 한 페이지씩 기다리지 않고 15개 페이지를 동시에 전송합니다.
-    with ThreadPoolExecutor(max_workers=15) as executor:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
         results = list(executor.map(analyze_single_page, enumerate(images)))
     
     results.sort(key=lambda x: x[0])
@@ -0,0 +1,391 @@
+import json
+import re
+import threading
+import zlib
+import numpy as np
+from .utils import convert_pdf_to_images, extract_pdf_text, get_all_fingerprints, count_fingerprints, save_fingerprint
+
+# 이 값 이상 유사하면 기존 분석 결과 재사용을 제안합니다.
+DUP_THRESHOLD = 0.9
+# 페이지 dHash 크기: 17x16으로 축소해 256bit (9x8/64bit는 흰 글씨 슬라이드가 모두 같은 해시가 됨)
+PAGE_HASH_SIZE = 16
+PAGE_HASH_BITS = PAGE_HASH_SIZE * PAGE_HASH_SIZE
+# 두 페이지 dHash의 해밍 거리가 이 값 이하이고, 두 해시에 켜진 비트 합집합의 PAGE_HASH_DIFF_RATIO 이하이면
+# 같은 페이지로 간주 (재압축/재내보내기 허용 범위. 여백이 많은 슬라이드는 켜진 비트가 적어 비율로도 제한)
+PAGE_HAMMING_MAX = 24
+PAGE_HASH_DIFF_RATIO = 0.35
+# 1(또는 0) 비트가 이보다 적은 해시는 단색/여백 위주 페이지로 보고 이미지만으로는 일치 판단에 쓰지 않습니다.
+PAGE_HASH_MIN_BITS = 16
+# 지문 계산용 래스터화 DPI (dHash는 17x16으로 축소하므로 저해상도로 충분)
+FINGERPRINT_DPI = 36
+
+# MinHash: 64개 해시 함수, LSH는 4행씩 16개 밴드 (유사도 약 0.5 이상부터 후보로 잡힘)
+NUM_PERM = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+# 페이지 해시는 32bit 조각을 버킷 키로 쓰되(켜진/꺼진 비트가 LSH_CHUNK_MIN_BITS 미만인 조각 제외),
+# 이 비율 이상의 페이지가 실제로 일치하는 덱만 후보로 봅니다.
+LSH_CHUNK_MIN_BITS = 2
+LSH_PAGE_VOTE_RATIO = 0.5
+SHINGLE_SIZE = 5
+# 페이지별 텍스트 유사도(Jaccard 추정)용 MinHash: 짧은 슬라이드 텍스트라 3-gram, 앞쪽 16개 해시 함수만 사용
+PAGE_SHINGLE_SIZE = 3
+PAGE_NUM_PERM = 16
+# 덱의 이 비율 이상 페이지에 반복되는 줄(숫자 무시)은 머리글/바닥글로 보고 텍스트 비교에서 제외합니다.
+# (버전/날짜 바닥글만 바뀐 덱이 모든 페이지 '텍스트 변경'이 되지 않도록)
+BOILERPLATE_PAGE_RATIO = 0.5
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+def page_dhash(img):
+    """페이지 이미지의 256bit difference hash (해상도/JPEG 압축 차이에 강함)"""
+    width = PAGE_HASH_SIZE + 1
+    small = img.convert("L").resize((width, PAGE_HASH_SIZE))
+    px = list(small.getdata())
+    value = 0
+    for row in range(PAGE_HASH_SIZE):
+        for col in range(PAGE_HASH_SIZE):
+            left = px[row * width + col]
+            right = px[row * width + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+def _informative(page_hash):
+    """단색 배경/흰 글씨 슬라이드처럼 어느 덱에서나 비슷하게 나오는 저엔트로피 해시가 아닌지"""
+    ones = bin(page_hash).count("1")
+    return PAGE_HASH_MIN_BITS <= ones <= PAGE_HASH_BITS - PAGE_HASH_MIN_BITS
+
+def _minhash(text, shingle_size, num_perm):
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    if len(words) < shingle_size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+    # crc32(32bit) x a(32bit) < 2^64 이므로 uint64 연산에서 넘치지 않습니다.
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+    values = (np.outer(hashes, _PERM_A[:num_perm]) + _PERM_B[:num_perm]) % _MERSENNE_PRIME
+    return [int(v) for v in values.min(axis=0)]
+
+def text_minhash(page_texts):
+    """
+    텍스트 레이어 전체의 단어 5-gram MinHash 서명.
+    텍스트 레이어가 없으면 None (이미지 기반 페이지 해시로만 비교)
+    """
+    return _minhash(" ".join(page_texts or []), SHINGLE_SIZE, NUM_PERM)
+
+def page_text_minhash(text):
+    """페이지 텍스트의 단어 3-gram MinHash 서명 (재추출 차이/일부 수정 정도를 Jaccard로 추정). 텍스트가 없으면 None"""
+    return _minhash(text or "", PAGE_SHINGLE_SIZE, PAGE_NUM_PERM)
+
+def _boilerplate_key(line):
+    return re.sub(r"\d+", "#", "".join(line.split()).lower())
+
+def strip_boilerplate(page_texts):
+    """여러 페이지에 반복되는 머리글/바닥글 줄(숫자만 다른 쪽번호·날짜·버전 포함)을 제거한 페이지 텍스트"""
+    if not page_texts or len(page_texts) < 3:
+        return page_texts
+    counts = {}
+    for text in page_texts:
+        for key in {_boilerplate_key(line) for line in text.splitlines()}:
+            counts[key] = counts.get(key, 0) + 1
+    repeated = {key for key, n in counts.items() if key and n >= BOILERPLATE_PAGE_RATIO * len(page_texts)}
+    return [
+        "\n".join(line for line in text.splitlines() if _boilerplate_key(line) not in repeated)
+        for text in page_texts
+    ]
+
+def page_text_hash(text):
+    """
+    페이지 텍스트 레이어의 해시 (공백/대소문자 무시).
+    레이아웃이 같아 dHash가 같아도 매출·인원·밸류에이션 등 수치가 바뀐 페이지를 구분합니다.
+    텍스트가 없으면 None
+    """
+    normalized = "".join((text or "").split()).lower()
+    if not normalized:
+        return None
+    return zlib.crc32(normalized.encode("utf-8"))
+
+def fingerprint_from_pages(images, page_texts):
+    """이미 변환된 페이지 이미지/텍스트로 덱 지문 계산"""
+    page_texts = strip_boilerplate(page_texts)
+    # 텍스트 레이어 페이지 수가 다르면 페이지별 대응을 신뢰할 수 없으므로 페이지 텍스트 해시 생략
+    if page_texts and len(page_texts) == len(images):
+        text_hashes = [page_text_hash(t) for t in page_texts]
+        text_minhashes = [page_text_minhash(t) for t in page_texts]
+    else:
+        text_hashes = [None] * len(images)
+        text_minhashes = [None] * len(images)
+    return {
+        "page_hashes": [page_dhash(img) for img in images],
+        "page_text_hashes": text_hashes,
+        "page_text_minhashes": text_minhashes,
+        "minhash": text_minhash(page_texts)
+    }
+
+def compute_fingerprint(pdf_bytes):
+    """PDF 바이너리에서 덱 지문 계산 (저해상도 래스터화 + 텍스트 레이어, 분석 전 수 초 이내)"""
+    images = convert_pdf_to_images(pdf_bytes, dpi=FINGERPRINT_DPI)
+    return fingerprint_from_pages(images, extract_pdf_text(pdf_bytes))
+
+def _hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def _same_layout(a, b, dist):
+    return dist <= PAGE_HAMMING_MAX and dist <= PAGE_HASH_DIFF_RATIO * bin(a | b).count("1")
+
+def _texts_differ(a, b):
+    # 한쪽이라도 텍스트 해시가 없으면 (텍스트 레이어 없음) 이미지로만 판단
+    return a is not None and b is not None and a != b
+
+def _text_similarity(a, b):
+    """페이지 MinHash로 추정한 텍스트 Jaccard 유사도. 한쪽이라도 없으면 None"""
+    if not a or not b:
+        return None
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def _page_fields(fp):
+    count = len(fp["page_hashes"])
+    return (
+        fp["page_hashes"],
+        fp.get("page_text_hashes") or [None] * count,
+        fp.get("page_text_minhashes") or [None] * count
+    )
+
+def _page_matches(src_fp, dst_fp):
+    """
+    src 각 페이지에 대해 (가장 가까운 dst 페이지 번호(0부터) 또는 None, 상태, 텍스트 유사도) 목록.
+    상태: "same"(이미지·텍스트 동일), "text_changed"(레이아웃은 같고 텍스트가 다름), "new"(대응 페이지 없음)
+    텍스트까지 같은 페이지를 우선 대응시키고, 없을 때만 레이아웃이 같은 페이지 중 텍스트가 가장 비슷한 페이지를
+    "text_changed"로 봅니다. 텍스트 유사도는 "same"이면 1.0, "text_changed"이면 페이지 MinHash 추정값(없으면 None)
+    """
+    dst_hashes, dst_texts, dst_minhashes = _page_fields(dst_fp)
+
+    matches = []
+    for h, text, minhash in zip(*_page_fields(src_fp)):
+        best_same, best_same_dist = None, PAGE_HAMMING_MAX + 1
+        best_changed, best_changed_rank = None, None
+        for j, (other, other_text) in enumerate(zip(dst_hashes, dst_texts)):
+            dist = _hamming(h, other)
+            if not _same_layout(h, other, dist):
+                continue
+            if not _texts_differ(text, other_text):
+                if dist < best_same_dist:
+                    best_same, best_same_dist = j, dist
+                continue
+            text_sim = _text_similarity(minhash, dst_minhashes[j])
+            rank = (text_sim or 0, -dist)
+            if best_changed_rank is None or rank > best_changed_rank:
+                best_changed, best_changed_rank = (j, text_sim), rank
+        if best_same is not None:
+            matches.append((best_same, "same", 1.0))
+        elif best_changed is not None:
+            matches.append((best_changed[0], "text_changed", best_changed[1]))
+        else:
+            matches.append((None, "new", None))
+    return matches
+
+def _page_hit_ratio(src_fp, dst_fp):
+    """
+    src 페이지 중 dst에 같은 페이지가 있는 비율.
+    텍스트만 바뀐 페이지(바닥글 외 수정, 재추출 차이)는 텍스트 유사도만큼 반영하고,
+    텍스트 근거가 없는 페이지(어느 한쪽에 텍스트 레이어 없음)는 해시가 저엔트로피이면 일치로 세지 않습니다.
+    """
+    _, src_texts, _ = _page_fields(src_fp)
+    _, dst_texts, _ = _page_fields(dst_fp)
+    hits = 0
+    for h, text, (match, status, text_sim) in zip(src_fp["page_hashes"], src_texts, _page_matches(src_fp, dst_fp)):
+        if status == "text_changed":
+            hits += text_sim or 0
+        elif status == "same" and ((text is not None and dst_texts[match] is not None) or _informative(h)):
+            hits += 1
+    return hits / len(src_fp["page_hashes"])
+
+def similarity(fp_a, fp_b):
+    """
+    두 덱 지문의 유사도 (0~1).
+    - 페이지 유사도: 양쪽 덱에서 상대 덱에 이미지·텍스트가 같은(텍스트만 바뀌었으면 텍스트 유사도만큼) 페이지가 있는 비율 중 작은 값
+      (작은 쪽을 쓰므로 페이지 수가 크게 다르면 낮아지고, 텍스트 근거 없는 단색 페이지는 세지 않음)
+    - 텍스트 유사도: MinHash 일치 비율 (양쪽 모두 텍스트 레이어가 있을 때만)
+    사용 가능한 값들의 평균을 반환합니다.
+    """
+    scores = []
+    a_pages, b_pages = fp_a["page_hashes"], fp_b["page_hashes"]
+    if a_pages and b_pages:
+        scores.append(min(_page_hit_ratio(fp_a, fp_b), _page_hit_ratio(fp_b, fp_a)))
+    if fp_a["minhash"] and fp_b["minhash"]:
+        same = sum(x == y for x, y in zip(fp_a["minhash"], fp_b["minhash"]))
+        scores.append(same / NUM_PERM)
+    return sum(scores) / len(scores) if scores else 0.0
+
+def diff_pages(new_fp, old_fp):
+    """
+    새 덱의 페이지별 (대응되는 기존 덱 페이지 번호(1부터) 또는 None, 상태, 텍스트 유사도) 목록.
+    상태는 "same" / "text_changed" / "new" (_page_matches 참고)
+    """
+    return [
+        (None if m is None else m + 1, status, text_sim)
+        for m, status, text_sim in _page_matches(new_fp, old_fp)
+    ]
+
+class DeckIndex:
+    """
+    저장된 모든 덱 지문에 대한 프로세스 내 LSH 인덱스.
+    MinHash 밴드와 페이지 해시의 32bit 조각을 버킷 키로 사용해 후보 덱만 골라낸 뒤,
+    후보에 대해서만 정확한 유사도를 계산합니다.
+    같은 템플릿의 덱은 페이지 해시 조각을 많이 공유하므로, 페이지 버킷에는 (history_id, 페이지 해시)를 넣어
+    실제로 같은 페이지(_same_layout)인 경우만 세고, 전체 페이지의 LSH_PAGE_VOTE_RATIO 이상이
+    일치하는 덱만 후보로 남깁니다. 저엔트로피 페이지 해시와 켜진 비트가 거의 없는 조각은 키에서 제외합니다.
+    """
+
+    def __init__(self):
+        self._fingerprints = {}
+        self._buckets = {}
+        self._max_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    @property
+    def max_id(self):
+        """지금까지 추가된 가장 큰 history_id (증분 로드 기준)"""
+        return self._max_id
+
+    @staticmethod
+    def _text_keys(fp):
+        keys = set()
+        if fp["minhash"]:
+            for band in range(LSH_BANDS):
+                rows = tuple(fp["minhash"][band * LSH_ROWS:(band + 1) * LSH_ROWS])
+                keys.add(("t", band, rows))
+        return keys
+
+    @staticmethod
+    def _page_keys(page_hash):
+        keys = set()
+        if not _informative(page_hash):
+            return keys
+        for chunk in range(PAGE_HASH_BITS // 32):
+            value = (page_hash >> (32 * chunk)) & 0xFFFFFFFF
+            if LSH_CHUNK_MIN_BITS <= bin(value).count("1") <= 32 - LSH_CHUNK_MIN_BITS:
+                keys.add(("p", chunk, value))
+        return keys
+
+    @classmethod
+    def _entries(cls, record_id, fp):
+        """(버킷 키, 버킷에 넣을 값) 목록: 텍스트 밴드는 history_id, 페이지 조각은 (history_id, 페이지 해시)"""
+        entries = [(key, record_id) for key in cls._text_keys(fp)]
+        for h in fp["page_hashes"]:
+            entries.extend((key, (record_id, h)) for key in cls._page_keys(h))
+        return entries
+
+    def add(self, record_id, fp):
+        with self._lock:
+            self._remove_locked(record_id)
+            self._fingerprints[record_id] = fp
+            self._max_id = max(self._max_id, record_id)
+            for key, member in self._entries(record_id, fp):
+                self._buckets.setdefault(key, set()).add(member)
+
+    def _remove_locked(self, record_id):
+        fp = self._fingerprints.pop(record_id, None)
+        if fp is None:
+            return
+        for key, member in self._entries(record_id, fp):
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(member)
+                if not bucket:
+                    del self._buckets[key]
+
+    def remove(self, record_id):
+        with self._lock:
+            self._remove_locked(record_id)
+
+    def get(self, record_id):
+        return self._fingerprints.get(record_id)
+
+    def query(self, fp, threshold=DUP_THRESHOLD):
+        """유사도 threshold 이상인 기존 기록을 [(history_id, 유사도)]로 유사도 내림차순 반환"""
+        with self._lock:
+            candidates = set()
+            for key in self._text_keys(fp):
+                candidates |= self._buckets.get(key, set())
+            # 페이지마다 같은 페이지가 있는 덱을 한 번씩만 세어 투표
+            votes = {}
+            for h in fp["page_hashes"]:
+                seen, matched = set(), set()
+                for key in self._page_keys(h):
+                    for member in self._buckets.get(key, ()):
+                        if member in seen:
+                            continue
+                        seen.add(member)
+                        rid, other = member
+                        if rid not in matched and _same_layout(h, other, _hamming(h, other)):
+                            matched.add(rid)
+                for rid in matched:
+                    votes[rid] = votes.get(rid, 0) + 1
+            min_votes = LSH_PAGE_VOTE_RATIO * len(fp["page_hashes"])
+            candidates |= {rid for rid, count in votes.items() if count >= min_votes}
+            stored = [(rid, self._fingerprints[rid]) for rid in candidates]
+
+        results = []
+        for rid, other in stored:
+            score = similarity(fp, other)
+            if score >= threshold:
+                results.append((rid, score))
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results
+
+_index = None
+_index_lock = threading.Lock()
+
+def _fingerprint_from_row(page_hashes, minhash, page_text_hashes, page_text_minhashes):
+    hashes = json.loads(page_hashes)
+    # 64bit dHash로 저장된 이전 지문은 비교할 수 없으므로 페이지 해시 없이 텍스트로만 비교
+    if any(len(h) != PAGE_HASH_BITS // 4 for h in hashes):
+        hashes, page_text_hashes, page_text_minhashes = [], None, None
+    return {
+        "page_hashes": [int(h, 16) for h in hashes],
+        "page_text_hashes": json.loads(page_text_hashes) if page_text_hashes else None,
+        "page_text_minhashes": json.loads(page_text_minhashes) if page_text_minhashes else None,
+        "minhash": json.loads(minhash) if minhash else None
+    }
+
+def _load_fingerprints(index, after_id=0):
+    for record_id, *columns in get_all_fingerprints(after_id):
+        index.add(record_id, _fingerprint_from_row(*columns))
+
+def get_index():
+    """
+    DB의 지문으로 구성한 인덱스를 반환합니다.
+    batch_cli.py --save-db 등 다른 프로세스가 저장한 지문도 보이도록 호출할 때마다
+    새로 추가된 기록(history_id > 마지막 로드 id)만 증분 로드하고,
+    그래도 DB와 개수가 다르면 (다른 프로세스의 삭제, id 역순 저장) 전체를 다시 구성합니다.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DeckIndex()
+        _load_fingerprints(_index, _index.max_id)
+        if len(_index) != count_fingerprints():
+            index = DeckIndex()
+            _load_fingerprints(index)
+            _index = index
+        return _index
+
+def register_fingerprint(record_id, fp):
+    """분석 완료된 기록의 지문을 DB와 인덱스에 함께 등록"""
+    save_fingerprint(
+        record_id,
+        json.dumps([format(h, f"0{PAGE_HASH_BITS // 4}x") for h in fp["page_hashes"]]),
+        json.dumps(fp["minhash"]) if fp["minhash"] else None,
+        json.dumps(fp["page_text_hashes"]),
+        json.dumps(fp["page_text_minhashes"])
+    )
+    get_index().add(record_id, fp)
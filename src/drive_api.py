@@ -1,5 +1,7 @@
 import os
 import io
+import threading
+import time
 import streamlit as st
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
@@ -8,6 +10,12 @@ from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 SERVICE_ACCOUNT_FILE = 'service_account.json'
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
+# 상위 폴더 ID -> (결과 폴더 ID, 조회 시각) (배치마다 반복되는 폴더 조회 쿼리 생략)
+_result_folder_cache = {}
+# 캐시된 결과 폴더를 다시 조회하지 않고 사용하는 시간(초)
+RESULT_FOLDER_TTL = 600
+_result_folder_lock = threading.Lock()
+
 def get_drive_service():
     """
     구글 드라이브 서비스 객체 생성.
@@ -73,7 +81,16 @@ def get_drive_files(folder_id):
         return []
 
 def create_result_folder(parent_id):
-    """결과물 저장용 폴더 생성"""
+    """
+    결과물 저장용 폴더 생성.
+    찾거나 만든 폴더 ID는 RESULT_FOLDER_TTL 동안 API 호출 없이 재사용합니다.
+    그 사이 폴더가 삭제되면 업로드의 404 처리(refresh_result_folder)가 다시 찾고,
+    휴지통으로 옮겨진 경우는 TTL이 지난 뒤 조회에서 걸러집니다.
+    """
+    cached = _result_folder_cache.get(parent_id)
+    if cached and time.time() - cached[1] < RESULT_FOLDER_TTL:
+        return cached[0]
+    
     service = get_drive_service()
     if not service: return None
     
@@ -82,6 +99,7 @@ def create_result_folder(parent_id):
     folders = results.get('files', [])
     
     if folders:
+        _result_folder_cache[parent_id] = (folders[0]['id'], time.time())
         return folders[0]['id']
     
     file_metadata = {
@@ -90,8 +108,24 @@ def create_result_folder(parent_id):
         'parents': [parent_id]
     }
     folder = service.files().create(body=file_metadata, fields='id', supportsAllDrives=True).execute()
+    _result_folder_cache[parent_id] = (folder.get('id'), time.time())
     return folder.get('id')
 
+def refresh_result_folder(parent_id, dead_folder_id):
+    """
+    업로드 중 결과 폴더가 없어진(404) 경우 호출: 캐시를 비우고 결과 폴더를 다시 찾거나 생성합니다.
+    여러 업로드 워커가 동시에 호출해도 폴더가 중복 생성되지 않도록 잠금 안에서 처리합니다.
+    """
+    with _result_folder_lock:
+        cached = _result_folder_cache.get(parent_id)
+        if cached and cached[0] == dead_folder_id:
+            _result_folder_cache.pop(parent_id, None)
+        return create_result_folder(parent_id)
+
+def report_filename(filename):
+    """원본 PDF 파일명으로 결과 마크다운 파일명 생성"""
+    return f"{filename.replace('.pdf', '')}_분석보고서.md"
+
 def upload_to_drive(folder_id, filename, content):
     """결과 마크다운 업로드 (안정적인 세션 유지를 위해 내부에서 서비스 생성)"""
     try:
@@ -99,7 +133,7 @@ def upload_to_drive(folder_id, filename, content):
         if not service: return
         
         file_metadata = {
-            'name': f"{filename.replace('.pdf', '')}_분석보고서.md",
+            'name': report_filename(filename),
             'parents': [folder_id]
         }
         media = MediaIoBaseUpload(
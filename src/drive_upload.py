@@ -0,0 +1,321 @@
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+# 업로드 대기/실패 건을 보관하는 로컬 폴더 (드라이브 장애 시 재분석 없이 재업로드)
+OUTBOX_DIR = "data/outbox"
+# 이 크기를 넘는 파일만 resumable 세션을 엽니다. (작은 마크다운은 단일 요청이 더 빠름)
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+# 이 횟수만큼 실패한 항목은 재시도를 멈추고 outbox/failed/로 옮깁니다.
+MAX_UPLOAD_ATTEMPTS = 5
+# 재시도해도 성공할 수 없는 항목을 보관하는 outbox 하위 폴더 (수동 확인용)
+FAILED_DIRNAME = "failed"
+# zip 묶음 모드에서 배치 항목을 모아두는 outbox 하위 폴더 접두어
+BUNDLE_PREFIX = "bundle_"
+
+# 이 프로세스에서 아직 close()되지 않은 묶음 배치 ID (진행 중인 묶음을 재업로드 대상으로 오인하지 않도록)
+_active_bundles = set()
+_bundle_lock = threading.Lock()
+
+def _write_owner(bundle_dir):
+    with open(os.path.join(bundle_dir, "owner"), "w") as f:
+        f.write(str(os.getpid()))
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 권한 없음 등: 살아 있는 것으로 간주
+        return True
+    return True
+
+def _is_abandoned_bundle(bundle_dir, bundle_id):
+    """소유 프로세스가 종료되었거나, 이 프로세스 소유지만 close()되지 않고 버려진 묶음인지 확인"""
+    try:
+        with open(os.path.join(bundle_dir, "owner")) as f:
+            pid = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return True
+    if pid == os.getpid():
+        return bundle_id not in _active_bundles
+    return not _pid_alive(pid)
+
+def _is_not_found(e):
+    return isinstance(e, HttpError) and e.resp.status == 404
+
+def _is_permanent(e):
+    """잘못된 요청(400)이나 대상 폴더 없음(404)은 재시도해도 성공하지 않음 (403은 사용량 제한일 수 있어 제외)"""
+    return isinstance(e, HttpError) and e.resp.status in (400, 404)
+
+def _write_meta(path, meta):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# 404(대상 폴더 없음)는 재시도해도 성공하지 않으므로 바로 올려 폴더 재확인 로직으로 넘깁니다.
+@retry(
+    retry=retry_if_exception(lambda e: not _is_not_found(e)),
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    reraise=True
+)
+def _upload_bytes(service, folder_id, name, data, mimetype):
+    media = MediaIoBaseUpload(
+        io.BytesIO(data),
+        mimetype=mimetype,
+        resumable=len(data) > RESUMABLE_THRESHOLD
+    )
+    service.files().create(
+        body={'name': name, 'parents': [folder_id]},
+        media_body=media,
+        fields='id',
+        supportsAllDrives=True
+    ).execute()
+
+def _write_bundle_item(bundle_dir, folder_id, parent_id, name, data):
+    """묶음 항목 1건을 payload + 메타데이터(.json)로 기록 (메타데이터가 있어야 완성된 항목)"""
+    item_id = uuid.uuid4().hex
+    base = os.path.join(bundle_dir, item_id)
+    with open(base + ".payload", "wb") as f:
+        f.write(data)
+    _write_meta(base + ".json", {'folder_id': folder_id, 'parent_id': parent_id, 'name': name})
+
+def _read_bundle_items(bundle_dir):
+    items = []
+    for fname in sorted(os.listdir(bundle_dir)):
+        if not fname.endswith(".json"):
+            continue
+        base = os.path.join(bundle_dir, fname[:-len(".json")])
+        with open(base + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(base + ".payload", "rb") as f:
+            items.append((meta['folder_id'], meta.get('parent_id'), meta['name'], f.read()))
+    return items
+
+class UploadPipeline:
+    """
+    분석 루프와 분리된 비동기 드라이브 업로드 단계.
+    - submit()은 결과를 로컬 outbox에 먼저 기록한 뒤 즉시 반환하고, 업로드는 워커 스레드가 처리합니다.
+    - 업로드 성공 시 outbox 항목을 삭제하고, 재시도 후에도 실패하면 outbox에 남겨 retry_outbox()로 재업로드합니다.
+      MAX_UPLOAD_ATTEMPTS번 실패했거나 재시도해도 성공할 수 없는 오류(400, 폴더를 다시 찾을 수 없는 404)는
+      outbox/failed/로 옮겨 더 이상 재시도하지 않습니다.
+    - 업로드 중인 항목은 '<항목ID>.<PID>.inflight'로 소유 프로세스를 기록하고,
+      그 프로세스가 종료된 경우에만 retry_outbox()가 다시 가져갑니다.
+    - bundle=True이면 개별 업로드 대신 close() 시점에 배치 전체를 zip 하나로 묶어 업로드합니다.
+      묶음 항목도 submit() 즉시 outbox/bundle_<배치ID>/에 기록되므로, close() 전에 중단되어도
+      다음 retry_outbox()가 남은 묶음을 zip으로 다시 만들어 업로드합니다.
+    googleapiclient 서비스 객체는 스레드 안전하지 않으므로 워커 스레드마다 service_factory()로 새로 만듭니다.
+    folder_resolver(parent_id, dead_folder_id)를 주면, 대상 폴더가 삭제되어 404가 날 때
+    submit()의 parent_id로 결과 폴더를 다시 찾아 outbox 메타데이터를 고친 뒤 재업로드합니다.
+    """
+
+    def __init__(self, service_factory, max_workers=4, bundle=False, outbox_dir=OUTBOX_DIR, folder_resolver=None):
+        self.service_factory = service_factory
+        self.folder_resolver = folder_resolver
+        self.bundle = bundle
+        self.outbox_dir = outbox_dir
+        self.failed = []
+        self._bundle_dir = None
+        self._bundle_id = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        os.makedirs(outbox_dir, exist_ok=True)
+        if bundle:
+            self._bundle_id = uuid.uuid4().hex
+            self._bundle_dir = os.path.join(outbox_dir, BUNDLE_PREFIX + self._bundle_id)
+            os.makedirs(self._bundle_dir)
+            _write_owner(self._bundle_dir)
+            _active_bundles.add(self._bundle_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _service(self):
+        if getattr(self._local, "service", None) is None:
+            service = self.service_factory()
+            if not service:
+                raise RuntimeError("구글 드라이브 서비스 생성 실패 (인증 정보 확인 필요)")
+            self._local.service = service
+        return self._local.service
+
+    def _paths(self, entry_id, pid=None):
+        """(payload, 대기 메타데이터, pid 프로세스(기본: 현재 프로세스)의 업로드 중 메타데이터) 경로"""
+        base = os.path.join(self.outbox_dir, entry_id)
+        return base + ".payload", base + ".json", f"{base}.{pid or os.getpid()}.inflight"
+
+    def _write_outbox(self, folder_id, parent_id, name, data, mimetype):
+        """payload 기록 후 메타데이터를 '.inflight'(업로드 중) 상태로 기록"""
+        entry_id = uuid.uuid4().hex
+        payload_path, _, inflight_path = self._paths(entry_id)
+        with open(payload_path, "wb") as f:
+            f.write(data)
+        meta = {'folder_id': folder_id, 'parent_id': parent_id, 'name': name, 'mimetype': mimetype, 'attempts': 0}
+        _write_meta(inflight_path, meta)
+        return entry_id
+
+    def _upload_entry(self, entry_id):
+        payload_path, pending_path, inflight_path = self._paths(entry_id)
+        with open(inflight_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        try:
+            with open(payload_path, "rb") as f:
+                data = f.read()
+            try:
+                _upload_bytes(self._service(), meta['folder_id'], meta['name'], data, meta['mimetype'])
+            except Exception as e:
+                new_folder_id = self._resolve_dead_folder(meta, e)
+                if not new_folder_id:
+                    raise
+                # 고친 폴더 ID를 먼저 기록하여 이번에도 실패하면 다음 재시도가 새 폴더로 향하도록 합니다.
+                meta['folder_id'] = new_folder_id
+                _write_meta(inflight_path, meta)
+                _upload_bytes(self._service(), new_folder_id, meta['name'], data, meta['mimetype'])
+        except Exception as e:
+            meta['attempts'] = meta.get('attempts', 0) + 1
+            meta['last_error'] = str(e)
+            _write_meta(inflight_path, meta)
+            will_retry = not _is_permanent(e) and meta['attempts'] < MAX_UPLOAD_ATTEMPTS
+            if will_retry:
+                # '.json'(대기) 상태로 되돌려 다음 retry_outbox()에서 다시 업로드
+                os.replace(inflight_path, pending_path)
+            else:
+                self._move_to_failed(entry_id, payload_path, inflight_path)
+            with self._lock:
+                self.failed.append((meta['name'], str(e), will_retry))
+            return
+        os.remove(payload_path)
+        os.remove(inflight_path)
+
+    def _move_to_failed(self, entry_id, payload_path, inflight_path):
+        failed_dir = os.path.join(self.outbox_dir, FAILED_DIRNAME)
+        os.makedirs(failed_dir, exist_ok=True)
+        base = os.path.join(failed_dir, entry_id)
+        os.replace(payload_path, base + ".payload")
+        os.replace(inflight_path, base + ".json")
+
+    def _resolve_dead_folder(self, meta, error):
+        """대상 폴더가 사라진 404이면 새 결과 폴더 ID를, 아니면 None을 반환"""
+        if not (_is_not_found(error) and self.folder_resolver and meta.get('parent_id')):
+            return None
+        new_folder_id = self.folder_resolver(meta['parent_id'], meta['folder_id'])
+        if not new_folder_id or new_folder_id == meta['folder_id']:
+            return None
+        return new_folder_id
+
+    def _enqueue(self, entry_id):
+        self._executor.submit(self._upload_entry, entry_id)
+
+    def submit(self, folder_id, name, content, mimetype='text/markdown', parent_id=None):
+        """
+        업로드 예약. 문자열은 UTF-8로 인코딩합니다.
+        parent_id는 folder_id(결과 폴더)의 상위 폴더로, 결과 폴더가 삭제되었을 때 다시 찾는 데 사용합니다.
+        """
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        if self.bundle:
+            _write_bundle_item(self._bundle_dir, folder_id, parent_id, name, data)
+            return
+        self._enqueue(self._write_outbox(folder_id, parent_id, name, data, mimetype))
+
+    def retry_outbox(self):
+        """이전 실행에서 실패했거나 중단된 업로드를 다시 예약하고, 예약한 건수를 반환"""
+        count = 0
+        for fname in os.listdir(self.outbox_dir):
+            entry_id, ext = os.path.splitext(fname)
+            if ext == ".inflight":
+                # 소유 프로세스가 종료된 '업로드 중' 항목만 가져옵니다. (살아 있으면 아직 업로드 중)
+                entry_id, _, pid = entry_id.partition(".")
+                try:
+                    pid = int(pid)
+                except ValueError:
+                    continue
+                if pid == os.getpid() or _pid_alive(pid):
+                    continue
+                source = self._paths(entry_id, pid)[2]
+            elif ext == ".json":
+                source = self._paths(entry_id)[1]
+            else:
+                continue
+            # rename으로 항목을 선점하여 다른 프로세스와 중복 업로드하지 않도록 합니다.
+            # (선점한 파일명에 이 프로세스의 PID가 들어가므로 소유자 기록도 원자적으로 바뀝니다)
+            try:
+                os.replace(source, self._paths(entry_id)[2])
+            except OSError:
+                continue
+            self._enqueue(entry_id)
+            count += 1
+        count += self._retry_bundles()
+        return count
+
+    def _retry_bundles(self):
+        """중단되어 zip으로 만들어지지 못한 묶음을 다시 zip으로 만들어 업로드 예약"""
+        count = 0
+        for fname in os.listdir(self.outbox_dir):
+            path = os.path.join(self.outbox_dir, fname)
+            if not fname.startswith(BUNDLE_PREFIX) or not os.path.isdir(path):
+                continue
+            bundle_id = fname[len(BUNDLE_PREFIX):].split(".")[0]
+            # 같은 프로세스의 다른 세션과 동시에 선점하지 않도록 확인~선점을 잠금 안에서 수행
+            with _bundle_lock:
+                if not _is_abandoned_bundle(path, bundle_id):
+                    continue
+                claimed = os.path.join(self.outbox_dir, f"{BUNDLE_PREFIX}{bundle_id}.{uuid.uuid4().hex}")
+                try:
+                    os.rename(path, claimed)
+                except OSError:
+                    continue
+                _write_owner(claimed)
+                _active_bundles.add(bundle_id)
+            try:
+                count += self._flush_bundle_dir(claimed)
+            finally:
+                _active_bundles.discard(bundle_id)
+        return count
+
+    def _flush_bundle_dir(self, bundle_dir):
+        """묶음 폴더의 항목을 폴더별 zip 하나로 묶어 업로드 예약한 뒤 묶음 폴더를 삭제"""
+        if not os.path.isdir(bundle_dir):
+            return 0
+        by_folder = {}
+        for folder_id, parent_id, name, data in _read_bundle_items(bundle_dir):
+            by_folder.setdefault((folder_id, parent_id), []).append((name, data))
+
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        for (folder_id, parent_id), files in by_folder.items():
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+                for name, data in files:
+                    zf.writestr(name, data)
+            archive_name = f"[분석결과]_{stamp}_{len(files)}건.zip"
+            self._enqueue(self._write_outbox(folder_id, parent_id, archive_name, buf.getvalue(), 'application/zip'))
+        # zip이 outbox에 기록된 뒤에만 원본 항목을 지웁니다.
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        return len(by_folder)
+
+    def close(self):
+        """
+        남은 업로드를 모두 기다린 뒤 실패 목록 [(파일명, 오류, 재시도 여부)]을 반환.
+        재시도 여부가 False인 항목은 outbox/failed/로 옮겨져 자동 재업로드되지 않습니다.
+        """
+        if self.bundle and self._bundle_id in _active_bundles:
+            try:
+                self._flush_bundle_dir(self._bundle_dir)
+            finally:
+                _active_bundles.discard(self._bundle_id)
+        self._executor.shutdown(wait=True)
+        return self.failed
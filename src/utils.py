@@ -1,38 +1,59 @@
 import io
 import os
+import re
 import shutil
 import sqlite3
+import subprocess
+import unicodedata
 import pandas as pd
 from datetime import datetime
 from pdf2image import convert_from_bytes
+from PIL import ImageDraw, ImageFilter
 
 DB_PATH = "data/history.db"
 
-def convert_pdf_to_images(pdf_bytes):
+# [하이브리드 모드] 페이지 분류 기준값
+# 텍스트 레이어 글자 수(공백 제외)가 TEXT_MIN_CHARS 미만이면 이미지 위주 페이지로 간주합니다.
+TEXT_MIN_CHARS = 200
+# 텍스트만 전송하려면: 텍스트가 충분하고(TEXT_ONLY_CHARS 이상) 채색 픽셀이 적으며,
+# 단어 박스(pdftotext -bbox) 밖의 잉크가 사실상 없어야 합니다. (가는 곡선/사선 차트도 이미지 유지)
+TEXT_ONLY_CHARS = 600
+TEXT_ONLY_GRAPHIC_RATIO = 0.05
+TEXT_ONLY_OUTSIDE_INK_RATIO = 0.001
+# 텍스트 레이어에서 정상 문자(글자/숫자/문장부호)가 이 비율 미만이면 깨진 텍스트로 보고 사용하지 않습니다.
+# (ToUnicode 매핑이 없는 한글 폰트 등)
+TEXT_READABLE_RATIO = 0.9
+# 그래픽 비율이 이 값 이하이면 텍스트 + 저해상도 이미지로 전송합니다.
+HYBRID_GRAPHIC_RATIO = 0.20
+HYBRID_INK_RATIO = 0.08
+
+def _find_poppler_dir(binary="pdftocairo"):
+    """Poppler 실행 파일이 있는 디렉터리를 탐색합니다. 찾지 못하면 None을 반환합니다."""
+    poppler_bin_path = shutil.which(binary)
+    if poppler_bin_path:
+        return os.path.dirname(poppler_bin_path)
+    for p in ["/opt/homebrew/bin", "/usr/local/bin"]:
+        if os.path.exists(os.path.join(p, binary)):
+            return p
+    return None
+
+def convert_pdf_to_images(pdf_bytes, dpi=120):
     """
     PDF 바이너리를 이미지 리스트로 변환합니다.
+    (중복 검사용 지문 계산처럼 저해상도면 충분한 경우 dpi를 낮춰 호출)
     [속도 최적화] 
     1. DPI를 200->120으로 조정하여 변환 및 전송 속도 향상
     2. thread_count를 설정하여 멀티코어 CPU 활용
     3. JPEG 압축을 통해 AI 전송 데이터 용량 최소화
     """
-    poppler_bin_path = shutil.which("pdftocairo")
-    
-    bin_dir = None
-    if poppler_bin_path:
-        bin_dir = os.path.dirname(poppler_bin_path)
-    else:
-        for p in ["/opt/homebrew/bin", "/usr/local/bin"]:
-            if os.path.exists(os.path.join(p, "pdftocairo")):
-                bin_dir = p
-                break
+    bin_dir = _find_poppler_dir("pdftocairo")
     
     try:
         # [최적화 1] DPI 120은 가독성과 속도 사이의 가장 효율적인 지점입니다.
         # [최적화 2] thread_count=4를 통해 PDF 변환 속도를 높입니다.
         images = convert_from_bytes(
             pdf_bytes, 
-            dpi=120, 
+            dpi=dpi, 
             poppler_path=bin_dir if bin_dir else None,
             thread_count=4
         )
@@ -55,6 +76,178 @@ def convert_pdf_to_images(pdf_bytes):
         )
         raise Exception(error_msg)
 
+def _run_pdftotext(pdf_bytes, options):
+    """pdftotext 실행 결과(stdout 문자열). 실패하면 None"""
+    bin_dir = _find_poppler_dir("pdftotext")
+    cmd = os.path.join(bin_dir, "pdftotext") if bin_dir else "pdftotext"
+    try:
+        # '-' 입력/출력으로 임시 파일 없이 처리
+        proc = subprocess.run(
+            [cmd, *options, "-enc", "UTF-8", "-", "-"],
+            input=pdf_bytes,
+            capture_output=True,
+            timeout=120,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return proc.stdout.decode("utf-8", errors="ignore")
+
+def extract_pdf_text(pdf_bytes):
+    """
+    Poppler(pdftotext)로 PDF의 텍스트 레이어를 페이지별로 추출합니다.
+    PowerPoint/Keynote에서 내보낸 IR 자료는 정확한 텍스트 레이어를 가지고 있어
+    이미지 인식보다 빠르고 수치가 정확합니다.
+    텍스트 레이어가 없거나 추출에 실패하면 빈 리스트를 반환합니다. (이미지 전용 분석으로 대체)
+    """
+    output = _run_pdftotext(pdf_bytes, ["-layout"])
+    if output is None:
+        return []
+
+    # 페이지 구분은 폼피드(\f) 문자
+    pages = output.split("\f")
+    # 마지막 폼피드 뒤의 빈 조각 제거
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return [p.strip() for p in pages]
+
+_BBOX_PAGE_RE = re.compile(r'<page width="([\d.]+)" height="([\d.]+)">(.*?)</page>', re.S)
+_BBOX_WORD_RE = re.compile(r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">')
+
+def extract_pdf_word_boxes(pdf_bytes):
+    """
+    pdftotext -bbox로 페이지별 단어 영역을 추출합니다.
+    반환: [(페이지 폭, 페이지 높이, [(x0, y0, x1, y1), ...]), ...] (PDF 포인트 단위)
+    추출에 실패하면 빈 리스트 (텍스트 전용 전송을 하지 않음)
+    """
+    output = _run_pdftotext(pdf_bytes, ["-bbox"])
+    if output is None:
+        return []
+    pages = []
+    for width, height, body in _BBOX_PAGE_RE.findall(output):
+        words = [tuple(float(v) for v in m) for m in _BBOX_WORD_RE.findall(body)]
+        pages.append((float(width), float(height), words))
+    return pages
+
+def _text_readable(text):
+    """
+    텍스트 레이어가 실제로 읽을 수 있는 문자인지 확인합니다.
+    폰트에 유니코드 매핑이 없으면 사용자 정의 영역(PUA)/대체 문자/제어 문자가 대량으로 추출됩니다.
+    """
+    chars = "".join(text.split())
+    if not chars:
+        return False
+    valid = 0
+    for ch in chars:
+        category = unicodedata.category(ch)
+        if ch == "\ufffd" or category in ("Co", "Cn", "Cc", "Cs"):
+            continue
+        valid += 1
+    return valid / len(chars) >= TEXT_READABLE_RATIO
+
+def _graphic_ratio(img):
+    """
+    페이지 이미지에서 차트/사진/도표로 추정되는 '채색 픽셀' 비율을 계산합니다.
+    축소한 썸네일의 채도(S) 기준이라 페이지당 수 ms 이내로 끝납니다.
+    """
+    thumb = img.convert("RGB")
+    thumb.thumbnail((200, 200))
+    saturation = thumb.convert("HSV").getchannel("S")
+    pixels = list(saturation.getdata())
+    if not pixels:
+        return 0.0
+    colorful = sum(1 for s in pixels if s > 60)
+    return colorful / len(pixels)
+
+def _non_text_ink_ratio(img):
+    """
+    채도와 무관하게 텍스트가 아닌 잉크(흑백 차트, 표 테두리, 선 도표, 사진)의 비율을 추정합니다.
+    - 배경색(가장 흔한 밝기)과 차이가 큰 픽셀을 잉크로 보고,
+    - 침식(MinFilter)으로 글자 획을 지운 뒤 남는 면적(막대, 채운 도형, 사진)과
+    - 가로/세로로 길게 이어진 잉크(축, 격자선, 표 테두리, 연결선)를 합산합니다.
+    """
+    gray = img.convert("L")
+    gray.thumbnail((400, 400))
+    width, height = gray.size
+    if not width or not height:
+        return 0.0
+    hist = gray.histogram()
+    background = hist.index(max(hist))
+    ink = gray.point(lambda v: 255 if abs(v - background) > 48 else 0)
+
+    # 썸네일에서 글자 획 굵기는 4px 이하이므로 5x5 침식 후 남는 픽셀은 면 형태의 그래픽입니다.
+    solid = ink.filter(ImageFilter.MinFilter(5)).histogram()[255]
+
+    px = list(ink.getdata())
+    min_row_run = width // 4
+    min_col_run = height // 4
+
+    def long_run_pixels(lines, min_run):
+        total = 0
+        for line in lines:
+            run = 0
+            for v in line:
+                if v:
+                    run += 1
+                    continue
+                if run >= min_run:
+                    total += run
+                run = 0
+            if run >= min_run:
+                total += run
+        return total
+
+    rows = (px[y * width:(y + 1) * width] for y in range(height))
+    cols = (px[x::width] for x in range(width))
+    lines = long_run_pixels(rows, min_row_run) + long_run_pixels(cols, min_col_run)
+    return (solid + lines) / (width * height)
+
+def _outside_text_ink_ratio(img, page_box):
+    """
+    단어 박스 밖에 있는 잉크 비율. 사선/곡선 그래프, 외곽선만 있는 원형 차트, 아이콘처럼
+    얇아서 면적·직선 기준으로는 잡히지 않는 그래픽도 텍스트가 아니면 모두 집계됩니다.
+    """
+    page_width, page_height, words = page_box
+    gray = img.convert("L")
+    gray.thumbnail((400, 400))
+    width, height = gray.size
+    if not width or not height or not page_width or not page_height:
+        return 1.0
+    hist = gray.histogram()
+    background = hist.index(max(hist))
+    ink = gray.point(lambda v: 255 if abs(v - background) > 48 else 0)
+
+    # 단어 영역(안티앨리어싱 여유 2px 포함)을 지우고 남은 잉크를 셉니다.
+    sx, sy = width / page_width, height / page_height
+    draw = ImageDraw.Draw(ink)
+    for x0, y0, x1, y1 in words:
+        draw.rectangle((x0 * sx - 2, y0 * sy - 2, x1 * sx + 2, y1 * sy + 2), fill=0)
+    return ink.histogram()[255] / (width * height)
+
+def classify_page(img, text, page_box=None):
+    """
+    [하이브리드 모드] 페이지별 전송 방식을 로컬 휴리스틱으로 결정합니다.
+    - "text"  : 텍스트 레이어만 전송 (단어 박스 밖에 잉크가 없는 텍스트 전용 페이지)
+    - "hybrid": 텍스트 + 저해상도 이미지 전송 (텍스트가 많은 기본 경우)
+    - "image" : 기존과 동일한 고해상도 이미지 전송 (차트/도표 위주 페이지, 깨진 텍스트 레이어)
+    page_box는 extract_pdf_word_boxes의 해당 페이지 항목이며, 없으면 텍스트 전용으로 보내지 않습니다.
+    """
+    # -layout 출력은 공백으로 정렬되므로 공백을 제외한 글자 수로 판단합니다.
+    char_count = len("".join((text or "").split()))
+    if char_count < TEXT_MIN_CHARS or not _text_readable(text):
+        return "image"
+
+    color_ratio = _graphic_ratio(img)
+    ink_ratio = _non_text_ink_ratio(img)
+    if (page_box is not None
+            and char_count >= TEXT_ONLY_CHARS
+            and color_ratio <= TEXT_ONLY_GRAPHIC_RATIO
+            and _outside_text_ink_ratio(img, page_box) <= TEXT_ONLY_OUTSIDE_INK_RATIO):
+        return "text"
+    if color_ratio <= HYBRID_GRAPHIC_RATIO and ink_ratio <= HYBRID_INK_RATIO:
+        return "hybrid"
+    return "image"
+
 def init_db():
     """DB 초기화: 데이터 폴더 및 히스토리 테이블 생성"""
     if not os.path.exists('data'):
@@ -71,6 +264,22 @@ def init_db():
             strategic_summary TEXT
         )
     """)
+    # 중복 IR 탐지용 덱 지문 (페이지별 perceptual hash/텍스트 해시/텍스트 MinHash + 덱 텍스트 MinHash, JSON 문자열)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ir_fingerprint (
+            history_id INTEGER PRIMARY KEY,
+            page_hashes TEXT,
+            text_minhash TEXT,
+            page_text_hashes TEXT,
+            page_text_minhashes TEXT
+        )
+    """)
+    # 나중에 추가된 컬럼이 없던 기존 DB 보완
+    cur.execute("PRAGMA table_info(ir_fingerprint)")
+    columns = [row[1] for row in cur.fetchall()]
+    for column in ("page_text_hashes", "page_text_minhashes"):
+        if column not in columns:
+            cur.execute(f"ALTER TABLE ir_fingerprint ADD COLUMN {column} TEXT")
     conn.commit()
     conn.close()
 
@@ -83,8 +292,24 @@ def check_cache(filename):
     conn.close()
     return result
 
+def get_history_record(record_id):
+    """id로 히스토리 기록 1건 조회 (없으면 None)"""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT filename, analysis_date, page_detail, strategic_summary FROM ir_history WHERE id = ?", (record_id,))
+    row = cur.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {
+        "filename": row[0],
+        "analysis_date": row[1],
+        "page_detail": row[2],
+        "strategic_summary": row[3]
+    }
+
 def save_to_db(filename, page_md, total_md):
-    """분석 완료된 데이터를 DB에 저장"""
+    """분석 완료된 데이터를 DB에 저장하고 생성된 기록 id를 반환"""
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -92,8 +317,48 @@ def save_to_db(filename, page_md, total_md):
         INSERT INTO ir_history (filename, analysis_date, page_detail, strategic_summary) 
         VALUES (?, ?, ?, ?)
     """, (filename, now, page_md, total_md))
+    record_id = cur.lastrowid
     conn.commit()
     conn.close()
+    return record_id
+
+def save_fingerprint(record_id, page_hashes, text_minhash, page_text_hashes, page_text_minhashes):
+    """히스토리 기록에 덱 지문 저장 (page_hashes/text_minhash/page_text_hashes/page_text_minhashes는 JSON 문자열)"""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT OR REPLACE INTO ir_fingerprint (history_id, page_hashes, text_minhash, page_text_hashes, page_text_minhashes)
+        VALUES (?, ?, ?, ?, ?)
+    """, (record_id, page_hashes, text_minhash, page_text_hashes, page_text_minhashes))
+    conn.commit()
+    conn.close()
+
+def get_all_fingerprints(after_id=0):
+    """
+    history_id가 after_id보다 큰 덱 지문을
+    (history_id, page_hashes, text_minhash, page_text_hashes, page_text_minhashes) 목록으로 반환
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT f.history_id, f.page_hashes, f.text_minhash, f.page_text_hashes, f.page_text_minhashes
+        FROM ir_fingerprint f JOIN ir_history h ON h.id = f.history_id
+        WHERE f.history_id > ?
+    """, (after_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def count_fingerprints():
+    """저장된 덱 지문 수 (다른 프로세스의 추가/삭제 감지용)"""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COUNT(*) FROM ir_fingerprint f JOIN ir_history h ON h.id = f.history_id
+    """)
+    count = cur.fetchone()[0]
+    conn.close()
+    return count
 
 def get_all_history():
     """전체 분석 히스토리 반환"""
@@ -107,5 +372,6 @@ def delete_history(record_id):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute("DELETE FROM ir_history WHERE id = ?", (record_id,))
+    cur.execute("DELETE FROM ir_fingerprint WHERE history_id = ?", (record_id,))
     conn.commit()
     conn.close()
\ No newline at end of file